@@ -1,10 +1,71 @@
+import functools
+import hashlib
+import os
+import tempfile
+import numpy as np
 import pandas as pd
-from geopy.distance import geodesic
+import pyarrow as pa
+import pyarrow.parquet as pq
 import streamlit as st
 from io import BytesIO
 import folium
+from folium.plugins import FastMarkerCluster
 from streamlit_folium import st_folium
 from pyproj import Geod
+from sklearn.neighbors import BallTree
+from nearest_ports import find_nearest_ports, to_unit_vectors
+
+# WGS84 ellipsoid used to draw geodesic route lines
+GEOD = Geod(ellps="WGS84")
+# Port count from which the BallTree index replaces the brute-force scan
+BALLTREE_MIN_PORTS = 500
+# Decimal places of the coordinate key used to deduplicate shipment endpoints (~100 m)
+COORDINATE_KEY_DECIMALS = 3
+# Per-upload results kept in the Streamlit data cache, and how long each one is kept
+RESULT_CACHE_MAX_ENTRIES = 16
+RESULT_CACHE_TTL = '1h'
+# Cleaned copy of 'ports.csv' for faster cold starts
+PORTS_PARQUET_PATH = 'ports.parquet'
+# Columns read from 'ports.csv' and their dtypes
+PORT_COLUMN_DTYPES = {
+    'Port Code': 'string[pyarrow]',
+    'Port Name': 'string[pyarrow]',
+    'Latitude': 'float64',
+    'Longitude': 'float64',
+}
+# Number of sampled ports shown on the overview map, and the seed that picks them
+PORT_MAP_SAMPLE_SIZE = 10
+PORT_MAP_SEED = 0
+# Leaflet marker factory for FastMarkerCluster rows of [lat, lon, name, code]
+PORT_MARKER_CALLBACK = """
+function (row) {
+    var icon = L.AwesomeMarkers.icon({icon: 'ship', prefix: 'fa', markerColor: 'blue'});
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {icon: icon});
+    marker.bindPopup(row[2] + ' (' + row[3] + ')');
+    marker.bindTooltip(row[2]);
+    return marker;
+}
+"""
+# Rows of the enriched data shown in the in-page preview
+PREVIEW_ROWS = 1000
+# Download formats for the enriched data: extension -> (label, MIME type)
+OUTPUT_FORMATS = {
+    'xlsx': ('Excel', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'parquet': ('Parquet', 'application/vnd.apache.parquet'),
+    'csv': ('CSV', 'text/csv'),
+}
+# Low-cardinality string columns of the enriched legs, stored as categoricals
+CATEGORICAL_LEG_COLUMNS = ['Origin', 'Destination', 'Mode', 'Vehicle Type', 'Customer Name']
+
+# Arrow holds one type per column. Object columns that mix types, and categoricals whose
+# categories do (numeric site codes next to port names), are converted to strings
+def to_arrow_compatible(df):
+    mixed_columns = [
+        column for column, dtype in df.dtypes.items()
+        if (isinstance(dtype, pd.CategoricalDtype) and df[column].cat.categories.inferred_type != 'string')
+        or (dtype == object and pd.api.types.infer_dtype(df[column]).startswith('mixed'))
+    ]
+    return df.astype(dict.fromkeys(mixed_columns, 'string'))
 
 # Set page configuration
 st.set_page_config(
@@ -47,48 +108,205 @@ shipment_file = st.sidebar.file_uploader(
     help="Upload an Excel file containing your shipment data."
 )
 
-# Read port data from 'ports.csv' in the project files
-@st.cache_data
-def load_ports_data():
+# Read port data from 'ports.csv' in the project files along with its derived lookup structures
+@st.cache_resource
+def load_ports_index():
     try:
-        ports_df = pd.read_csv('ports.csv')
-        # Clean column names and handle invalid data
-        ports_df.columns = ports_df.columns.str.strip()
-        # Convert Latitude and Longitude to numeric and drop invalid rows
-        ports_df['Latitude'] = pd.to_numeric(ports_df['Latitude'], errors='coerce')
-        ports_df['Longitude'] = pd.to_numeric(ports_df['Longitude'], errors='coerce')
-        ports_df.dropna(subset=['Latitude', 'Longitude'], inplace=True)
-        return ports_df
+        csv_mtime = os.path.getmtime('ports.csv')
     except FileNotFoundError:
         st.error("The 'ports.csv' file was not found in the project directory.")
         return None
+    # Reuse the cleaned Parquet copy unless 'ports.csv' changed after it was written
+    ports_df = None
+    if os.path.exists(PORTS_PARQUET_PATH) and os.path.getmtime(PORTS_PARQUET_PATH) >= csv_mtime:
+        try:
+            ports_df = pd.read_parquet(PORTS_PARQUET_PATH)
+        except (OSError, pa.ArrowException):
+            # A truncated or corrupt copy is rebuilt from the CSV below
+            pass
+        # A copy written with a different column set is stale as well
+        if ports_df is not None and list(ports_df.columns) != list(PORT_COLUMN_DTYPES):
+            ports_df = None
+    if ports_df is None:
+        try:
+            # Parse only the consumed columns, typed up front, with the Arrow CSV reader
+            ports_df = pd.read_csv(
+                'ports.csv',
+                engine='pyarrow',
+                usecols=list(PORT_COLUMN_DTYPES),
+                dtype=PORT_COLUMN_DTYPES,
+            )
+        except (ValueError, KeyError):
+            # A non-numeric coordinate or a padded header name defeats the typed read:
+            # parse untyped, clean column names and coerce invalid coordinates to NaN
+            ports_df = pd.read_csv('ports.csv')
+            ports_df.columns = ports_df.columns.str.strip()
+            missing_columns = sorted(set(PORT_COLUMN_DTYPES).difference(ports_df.columns))
+            if missing_columns:
+                st.error(f"The 'ports.csv' file is missing the columns: {', '.join(missing_columns)}")
+                return None
+            ports_df = ports_df[list(PORT_COLUMN_DTYPES)]
+            ports_df[['Latitude', 'Longitude']] = ports_df[['Latitude', 'Longitude']].apply(pd.to_numeric, errors='coerce')
+            ports_df = ports_df.astype(PORT_COLUMN_DTYPES)
+        # Drop rows with missing or invalid coordinates
+        ports_df = ports_df.dropna(subset=['Latitude', 'Longitude']).reset_index(drop=True)
+        # Write to a temporary file in the same directory and rename it into place, so a
+        # concurrent session or an interrupted write never leaves a partial copy behind
+        temp_path = None
+        try:
+            temp_fd, temp_path = tempfile.mkstemp(
+                prefix='ports.', suffix='.parquet.tmp',
+                dir=os.path.dirname(os.path.abspath(PORTS_PARQUET_PATH)),
+            )
+            with os.fdopen(temp_fd, 'wb') as temp_file:
+                ports_df.to_parquet(temp_file, compression='zstd', index=False)
+            os.replace(temp_path, PORTS_PARQUET_PATH)
+        except OSError:
+            # Read-only deployments simply parse the CSV on every cold start
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+    # Port coordinates in radians, and as unit vectors for the dot-product great-circle scan
+    lat_rad = np.radians(ports_df['Latitude'].values)
+    lon_rad = np.radians(ports_df['Longitude'].values)
+    ports_xyz = to_unit_vectors(lat_rad, lon_rad)
+    ports_xyz32 = ports_xyz.astype(np.float32)
+    # The cached resource is shared by every session, so lookups must never write to it
+    for array in (ports_xyz, ports_xyz32):
+        array.flags.writeable = False
+    # Haversine BallTree for O(log N) nearest-port lookups on large catalogs
+    ports_tree = None
+    if len(ports_df) >= BALLTREE_MIN_PORTS:
+        ports_tree = BallTree(np.column_stack([lat_rad, lon_rad]), metric='haversine')
+    return ports_df, ports_xyz, ports_xyz32, ports_tree
+
+# Geodesic polyline between two points; memoized because many legs share the same port pair.
+# Streamlit re-executes this script on every rerun, so the lru_cache is kept as a cached
+# resource instead of starting empty each time
+@st.cache_resource(show_spinner=False)
+def load_geodesic_line_cache():
+    @functools.lru_cache(maxsize=10000)
+    def get_geodesic_line(lat1, lon1, lat2, lon2, n_points=30):
+        points = GEOD.npts(lon1, lat1, lon2, lat2, n_points)
+        return ((lat1, lon1),) + tuple((lat, lon) for lon, lat in points) + ((lat2, lon2),)
+
+    return get_geodesic_line
+
+# Nearest port index and distance (km) for every origin, then every destination.
+# The lookup does not depend on the search radius, so it is cached on the uploaded
+# file's digest alone and radius changes only redo the masking and leg assembly. Like
+# the enriched results, entries are bounded in number and age
+@st.cache_data(max_entries=RESULT_CACHE_MAX_ENTRIES, ttl=RESULT_CACHE_TTL, show_spinner=False)
+def resolve_endpoint_ports(_shipments_df, _ports_index, file_digest):
+    # Streamlit does not hash leading-underscore arguments: the file digest stands in
+    # for the cleaned shipments, and the ports index is fixed for the process lifetime
+    _, ports_xyz, ports_xyz32, ports_tree = _ports_index
+    # Resolve origin and destination ports in a single batched query
+    endpoints = np.vstack([
+        _shipments_df[['Origin Latitude', 'Origin Longitude']].to_numpy(dtype=np.float64),
+        _shipments_df[['Destination Latitude', 'Destination Longitude']].to_numpy(dtype=np.float64)
+    ])
+    # Shipments often share warehouses and customer sites: look up each distinct
+    # endpoint on the rounded coordinate grid once and scatter the result back
+    unique_endpoints, endpoint_keys = np.unique(
+        endpoints.round(COORDINATE_KEY_DECIMALS), axis=0, return_inverse=True
+    )
+    unique_port_indices, unique_port_km = find_nearest_ports(np.radians(unique_endpoints), ports_xyz, ports_xyz32, ports_tree)
+    endpoint_keys = endpoint_keys.ravel()
+    return unique_port_indices.take(endpoint_keys), unique_port_km.take(endpoint_keys)
+
+# Enrich shipments with their three journey legs. The result is cached on the uploaded
+# file's digest and the search radius, so repeat runs skip the whole computation.
+# Every entry holds a full enriched frame, so the cache is bounded in size and age
+@st.cache_data(max_entries=RESULT_CACHE_MAX_ENTRIES, ttl=RESULT_CACHE_TTL, show_spinner=False)
+def enrich_shipments(_shipments_df, _ports_index, file_digest, radius_km):
+    shipments_df = _shipments_df
+    ports_df = _ports_index[0]
+    n_shipments = len(shipments_df)
+    port_indices, port_distances_km = resolve_endpoint_ports(shipments_df, _ports_index, file_digest)
+    origin_port_indices = port_indices[:n_shipments]
+    destination_port_indices = port_indices[n_shipments:]
+    origin_port_km = port_distances_km[:n_shipments]
+    destination_port_km = port_distances_km[n_shipments:]
+
+    # Skip shipments without a port inside the radius at either end
+    valid = (origin_port_km <= radius_km) & (destination_port_km <= radius_km)
+    n_skipped = int((~valid).sum())
+    if not valid.any():
+        return None, n_skipped
+
+    valid_shipments = shipments_df[valid]
+    n_valid = len(valid_shipments)
+    origin_ports = ports_df.iloc[origin_port_indices[valid]]
+    destination_ports = ports_df.iloc[destination_port_indices[valid]]
+    origin_port_names = origin_ports['Port Name'].to_numpy()
+    destination_port_names = destination_ports['Port Name'].to_numpy()
+    origin_port_lats = origin_ports['Latitude'].to_numpy()
+    origin_port_lons = origin_ports['Longitude'].to_numpy()
+    destination_port_lats = destination_ports['Latitude'].to_numpy()
+    destination_port_lons = destination_ports['Longitude'].to_numpy()
+    vehicle_types = valid_shipments['Vehicle Type'].to_numpy()
+
+    # Each shipment becomes three consecutive rows: per-shipment values are
+    # repeated, per-leg values are interleaved, fixed patterns are tiled
+    def repeat_legs(column):
+        return np.repeat(valid_shipments[column].to_numpy(), 3)
+
+    def interleave_legs(first, second, third):
+        return np.column_stack([first, second, third]).ravel()
+
+    enriched_shipments_df = pd.DataFrame({
+        'ID': repeat_legs('Consignment ID'),
+        'Sequence': np.tile([1, 2, 3], n_valid),
+        'Origin': interleave_legs(valid_shipments['Origin'].to_numpy(),
+                                  origin_port_names, destination_port_names),
+        'Destination': interleave_legs(origin_port_names, destination_port_names,
+                                       valid_shipments['Destination'].to_numpy()),
+        'Origin Latitude': interleave_legs(valid_shipments['Origin Latitude'].to_numpy(dtype=np.float64),
+                                           origin_port_lats, destination_port_lats),
+        'Origin Longitude': interleave_legs(valid_shipments['Origin Longitude'].to_numpy(dtype=np.float64),
+                                            origin_port_lons, destination_port_lons),
+        'Destination Latitude': interleave_legs(origin_port_lats, destination_port_lats,
+                                                valid_shipments['Destination Latitude'].to_numpy(dtype=np.float64)),
+        'Destination Longitude': interleave_legs(origin_port_lons, destination_port_lons,
+                                                 valid_shipments['Destination Longitude'].to_numpy(dtype=np.float64)),
+        'Load (Tons)': repeat_legs('Load (Tons)'),
+        'Mode': np.tile(['ROAD', 'SEA', 'ROAD'], n_valid),
+        'Vehicle Type': interleave_legs(vehicle_types, np.full(n_valid, None, dtype=object),
+                                        vehicle_types),
+        'Customer Name': repeat_legs('Customer Name'),
+        'Date': repeat_legs('Date')
+    }).astype(dict.fromkeys(CATEGORICAL_LEG_COLUMNS, 'category'))
+    return enriched_shipments_df, n_skipped
+
+ports_index = load_ports_index()
 
-ports_df = load_ports_data()
+if ports_index is not None:
+    ports_df = ports_index[0]
 
-if ports_df is not None:
-    # Cache the map creation to prevent reloading
+    # Cache the rendered map HTML so reruns skip marker construction and Leaflet rendering
     @st.cache_resource
-    def create_port_map(ports_df):
-        # Display 10 random ports on a map using Folium
-        random_ports_df = ports_df.sample(n=min(10, len(ports_df)))
+    def build_port_map(seed, n):
+        # Display n random ports on a map using Folium
+        rng = np.random.default_rng(seed)
+        random_ports_df = ports_df.iloc[rng.choice(len(ports_df), size=min(n, len(ports_df)), replace=False)]
+        # Pull the marker fields out once as aligned NumPy arrays
+        lats = random_ports_df['Latitude'].to_numpy()
+        lons = random_ports_df['Longitude'].to_numpy()
+        names = random_ports_df['Port Name'].to_numpy()
+        codes = random_ports_df['Port Code'].to_numpy()
         # Create a Folium map centered on the average coordinates of the ports
-        average_lat = random_ports_df['Latitude'].mean()
-        average_lon = random_ports_df['Longitude'].mean()
-        port_map = folium.Map(location=[average_lat, average_lon], zoom_start=2)
-        # Add port markers to the map
-        for _, row in random_ports_df.iterrows():
-            folium.Marker(
-                location=[row['Latitude'], row['Longitude']],
-                popup=f"{row['Port Name']} ({row['Port Code']})",
-                tooltip=row['Port Name'],
-                icon=folium.Icon(color='blue', icon='ship', prefix='fa')
-            ).add_to(port_map)
-        return port_map
+        port_map = folium.Map(location=[lats.mean(), lons.mean()], zoom_start=2, prefer_canvas=True)
+        # Add all port markers in one client-side batch; the callback rebuilds
+        # the ship icon, popup and tooltip from each [lat, lon, name, code] row
+        FastMarkerCluster(
+            data=list(zip(lats.tolist(), lons.tolist(), names.tolist(), codes.tolist())),
+            callback=PORT_MARKER_CALLBACK,
+        ).add_to(port_map)
+        return port_map.get_root().render()
 
     st.header("Port Locations")
     # Use the cached map
-    port_map = create_port_map(ports_df)
-    st_folium(port_map, width=700, height=450)
+    st.iframe(build_port_map(PORT_MAP_SEED, PORT_MAP_SAMPLE_SIZE), width=700, height=450)
 
     # Initialize session state for enriched shipments
     if 'enriched_shipments_df' not in st.session_state:
@@ -98,21 +316,29 @@ if ports_df is not None:
     if shipment_file is not None:
         st.header("Shipment Data Processing")
         try:
-            shipments_df = pd.read_excel(shipment_file)
-            # Ensure required columns are present
             required_columns = [
                 'Consignment ID', 'Origin', 'Origin Latitude', 'Origin Longitude',
                 'Destination', 'Destination Latitude', 'Destination Longitude',
                 'Load (Tons)', 'Customer Name', 'Vehicle Type', 'Date'
             ]
-            missing_columns = [col for col in required_columns if col not in shipments_df.columns]
+            # Parse only the required columns; a callable keeps absent ones from raising
+            # so they are reported below. Use the native calamine reader when it is installed.
+            # Default NumPy dtypes keep a stray text cell as an object value that the coercion
+            # below turns into NaN; an Arrow backend can reject the whole column instead
+            read_options = {'usecols': lambda column: column in required_columns}
+            try:
+                shipments_df = pd.read_excel(shipment_file, engine='calamine', **read_options)
+            except ImportError:
+                shipment_file.seek(0)
+                shipments_df = pd.read_excel(shipment_file, **read_options)
+            # Ensure required columns are present
+            missing_columns = sorted(set(required_columns).difference(shipments_df.columns))
             if missing_columns:
                 st.error(f"The following required columns are missing: {', '.join(missing_columns)}")
             else:
                 # Convert coordinate columns to numeric
                 coordinate_columns = ['Origin Latitude', 'Origin Longitude', 'Destination Latitude', 'Destination Longitude']
-                for col in coordinate_columns:
-                    shipments_df[col] = pd.to_numeric(shipments_df[col], errors='coerce')
+                shipments_df[coordinate_columns] = shipments_df[coordinate_columns].apply(pd.to_numeric, errors='coerce')
                 # Drop rows with invalid coordinates
                 shipments_df.dropna(subset=coordinate_columns, inplace=True)
                 if shipments_df.empty:
@@ -123,93 +349,13 @@ if ports_df is not None:
                     if process_shipments or st.session_state['enriched_shipments_df'] is not None:
                         if process_shipments:
                             with st.spinner('Processing your shipments...'):
-                                enriched_shipments = []
-
-                                def select_nearest_port(location_coords):
-                                    # Calculate distance from location to each port
-                                    ports_df['Distance'] = ports_df.apply(
-                                        lambda row: geodesic(location_coords, (row['Latitude'], row['Longitude'])).km,
-                                        axis=1
-                                    )
-                                    # Filter ports within the radius
-                                    nearby_ports = ports_df[ports_df['Distance'] <= radius_km].copy()
-                                    if nearby_ports.empty:
-                                        return None
-                                    # Select the port with the minimum distance
-                                    nearest_port = nearby_ports.loc[nearby_ports['Distance'].idxmin()]
-                                    return nearest_port
-
-                                for _, shipment in shipments_df.iterrows():
-                                    consignment_id = shipment['Consignment ID']
-                                    customer_name = shipment['Customer Name']
-                                    load_tons = shipment['Load (Tons)']
-                                    vehicle_type = shipment['Vehicle Type']
-                                    date = shipment['Date']
-
-                                    # Origin and destination coordinates
-                                    origin_coords = (shipment['Origin Latitude'], shipment['Origin Longitude'])
-                                    destination_coords = (shipment['Destination Latitude'], shipment['Destination Longitude'])
-
-                                    # Select nearest ports near origin and destination
-                                    origin_port = select_nearest_port(origin_coords)
-                                    destination_port = select_nearest_port(destination_coords)
-
-                                    if origin_port is None or destination_port is None:
-                                        st.warning(f"No suitable ports found within {radius_km} km for shipment {consignment_id}. Skipping.")
-                                        continue
-
-                                    # Create legs
-                                    legs = [
-                                        {
-                                            'ID': consignment_id,
-                                            'Sequence': 1,
-                                            'Origin': shipment['Origin'],
-                                            'Destination': origin_port['Port Name'],
-                                            'Origin Latitude': shipment['Origin Latitude'],
-                                            'Origin Longitude': shipment['Origin Longitude'],
-                                            'Destination Latitude': origin_port['Latitude'],
-                                            'Destination Longitude': origin_port['Longitude'],
-                                            'Load (Tons)': load_tons,
-                                            'Mode': 'ROAD',
-                                            'Vehicle Type': vehicle_type,
-                                            'Customer Name': customer_name,
-                                            'Date': date
-                                        },
-                                        {
-                                            'ID': consignment_id,
-                                            'Sequence': 2,
-                                            'Origin': origin_port['Port Name'],
-                                            'Destination': destination_port['Port Name'],
-                                            'Origin Latitude': origin_port['Latitude'],
-                                            'Origin Longitude': origin_port['Longitude'],
-                                            'Destination Latitude': destination_port['Latitude'],
-                                            'Destination Longitude': destination_port['Longitude'],
-                                            'Load (Tons)': load_tons,
-                                            'Mode': 'SEA',
-                                            'Vehicle Type': None,
-                                            'Customer Name': customer_name,
-                                            'Date': date
-                                        },
-                                        {
-                                            'ID': consignment_id,
-                                            'Sequence': 3,
-                                            'Origin': destination_port['Port Name'],
-                                            'Destination': shipment['Destination'],
-                                            'Origin Latitude': destination_port['Latitude'],
-                                            'Origin Longitude': destination_port['Longitude'],
-                                            'Destination Latitude': shipment['Destination Latitude'],
-                                            'Destination Longitude': shipment['Destination Longitude'],
-                                            'Load (Tons)': load_tons,
-                                            'Mode': 'ROAD',
-                                            'Vehicle Type': vehicle_type,
-                                            'Customer Name': customer_name,
-                                            'Date': date
-                                        }
-                                    ]
-                                    enriched_shipments.extend(legs)
-
-                                if enriched_shipments:
-                                    enriched_shipments_df = pd.DataFrame(enriched_shipments)
+                                file_digest = hashlib.sha256(shipment_file.getvalue()).hexdigest()
+                                enriched_shipments_df, n_skipped = enrich_shipments(
+                                    shipments_df, ports_index, file_digest, radius_km
+                                )
+                                if n_skipped:
+                                    st.warning(f"{n_skipped} shipment(s) skipped: no suitable port found within {radius_km} km.")
+                                if enriched_shipments_df is not None:
                                     st.session_state['enriched_shipments_df'] = enriched_shipments_df
                                 else:
                                     st.warning("No shipments were processed. Please adjust the search radius or check your shipment data.")
@@ -219,22 +365,44 @@ if ports_df is not None:
                             enriched_shipments_df = st.session_state['enriched_shipments_df']
                             st.success("Shipments processed successfully!")
                             st.subheader("Enriched Shipment Data")
-                            st.dataframe(enriched_shipments_df)
+                            # Only the preview is sent to the browser; downloads use the full frame
+                            st.dataframe(to_arrow_compatible(enriched_shipments_df.head(PREVIEW_ROWS)))
+                            if len(enriched_shipments_df) > PREVIEW_ROWS:
+                                st.caption(f"Showing first {PREVIEW_ROWS} of {len(enriched_shipments_df)} rows")
 
                             # Download button
-                            def convert_df(df):
+                            output_format = st.radio(
+                                "Output format:",
+                                list(OUTPUT_FORMATS),
+                                horizontal=True,
+                                help="Parquet and CSV are much faster to produce than Excel for large outputs."
+                            )
+
+                            def convert_df(df, output_format):
+                                if output_format == 'parquet':
+                                    # Mixed-type columns, such as IDs stored partly as numbers in Excel or
+                                    # numeric site codes next to port names, are written as strings
+                                    table = pa.Table.from_pandas(to_arrow_compatible(df), preserve_index=False)
+                                    # Serialize straight into an Arrow buffer, no temporary file
+                                    sink = pa.BufferOutputStream()
+                                    pq.write_table(table, sink)
+                                    return sink.getvalue().to_pybytes()
+                                if output_format == 'csv':
+                                    return df.to_csv(index=False).encode('utf-8')
                                 output = BytesIO()
-                                with pd.ExcelWriter(output, engine='openpyxl') as writer:
+                                # xlsxwriter is faster than openpyxl. Its constant_memory mode is not used:
+                                # pandas writes cells column by column, which that mode silently truncates
+                                with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
                                     df.to_excel(writer, index=False, sheet_name='Enriched Shipments')
                                 processed_data = output.getvalue()
                                 return processed_data
 
-                            excel_data = convert_df(enriched_shipments_df)
+                            format_label, mime_type = OUTPUT_FORMATS[output_format]
                             st.download_button(
-                                label="Download Enriched Data as Excel",
-                                data=excel_data,
-                                file_name='enriched_shipments.xlsx',
-                                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+                                label=f"Download Enriched Data as {format_label}",
+                                data=convert_df(enriched_shipments_df, output_format),
+                                file_name=f'enriched_shipments.{output_format}',
+                                mime=mime_type
                             )
 
                             # Visualization Section
@@ -246,46 +414,41 @@ if ports_df is not None:
                                 # Create a map centered at the average location of the shipment legs
                                 avg_lat = selected_shipment[['Origin Latitude', 'Destination Latitude']].mean().mean()
                                 avg_lon = selected_shipment[['Origin Longitude', 'Destination Longitude']].mean().mean()
-                                shipment_map = folium.Map(location=[avg_lat, avg_lon], zoom_start=4)
-                                geod = Geod(ellps="WGS84")  # Initialize Geod
+                                shipment_map = folium.Map(location=[avg_lat, avg_lon], zoom_start=4, prefer_canvas=True)
+                                get_geodesic_line = load_geodesic_line_cache()
 
-                                # Function to get geodesic line
-                                def get_geodesic_line(lat1, lon1, lat2, lon2, n_points=30):
-                                    points = geod.npts(lon1, lat1, lon2, lat2, n_points)
-                                    line = [(lat1, lon1)] + [(lat, lon) for lon, lat in points] + [(lat2, lon2)]
-                                    return line
-
-                                # Add markers and curved lines for each leg
-                                for _, leg in selected_shipment.iterrows():
-                                    origin = (leg['Origin Latitude'], leg['Origin Longitude'])
-                                    destination = (leg['Destination Latitude'], leg['Destination Longitude'])
-                                    mode = leg['Mode']
-                                    # Set color based on mode
-                                    if mode == 'SEA':
-                                        color = 'darkblue'
-                                    else:  # ROAD
-                                        color = 'saddlebrown'
+                                # A shipment has three legs and six endpoints, so each leg gets its own line
+                                # with a descriptive tooltip. Endpoints go into a plain FeatureGroup: clustering
+                                # would merge the ports shared by consecutive legs into count bubbles
+                                endpoints = folium.FeatureGroup(name='Leg endpoints').add_to(shipment_map)
+                                leg_columns = ['Origin Latitude', 'Origin Longitude', 'Destination Latitude',
+                                               'Destination Longitude', 'Mode', 'Origin', 'Destination']
+                                for (origin_lat, origin_lon, destination_lat, destination_lon,
+                                     mode, origin_name, destination_name) in selected_shipment[leg_columns].itertuples(index=False, name=None):
                                     # Generate geodesic line
-                                    line = get_geodesic_line(origin[0], origin[1], destination[0], destination[1])
-                                    # Add line
+                                    line = get_geodesic_line(*np.round([origin_lat, origin_lon, destination_lat, destination_lon], 5).tolist())
                                     folium.PolyLine(
                                         line,
-                                        color=color,
+                                        # Set color based on mode
+                                        color='darkblue' if mode == 'SEA' else 'saddlebrown',
                                         weight=5,
                                         opacity=0.8,
-                                        tooltip=f"{mode} leg from {leg['Origin']} to {leg['Destination']}"
-                                    ).add_to(shipment_map)
-                                    # Add markers
-                                    folium.Marker(
-                                        location=origin,
-                                        popup=leg['Origin'],
-                                        icon=folium.Icon(color='green' if mode == 'ROAD' else 'blue')
-                                    ).add_to(shipment_map)
-                                    folium.Marker(
-                                        location=destination,
-                                        popup=leg['Destination'],
-                                        icon=folium.Icon(color='green' if mode == 'ROAD' else 'blue')
+                                        tooltip=f"{mode} leg from {origin_name} to {destination_name}"
                                     ).add_to(shipment_map)
+                                    # Circle markers are drawn on the map canvas, not as DOM icons
+                                    marker_color = 'green' if mode == 'ROAD' else 'blue'
+                                    for lat, lon, name in ((origin_lat, origin_lon, origin_name),
+                                                           (destination_lat, destination_lon, destination_name)):
+                                        folium.CircleMarker(
+                                            location=[lat, lon],
+                                            radius=8,
+                                            color=marker_color,
+                                            fill=True,
+                                            fill_color=marker_color,
+                                            fill_opacity=0.8,
+                                            popup=str(name),
+                                            tooltip=f"{name}: {mode} leg from {origin_name} to {destination_name}"
+                                        ).add_to(endpoints)
                                 # Display the map
                                 st_folium(shipment_map, width=700, height=450)
 
@@ -0,0 +1,106 @@
+"""Nearest-port lookup over the port catalog's unit vectors, shared by app.py and its tests."""
+import functools
+import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional; the blocked NumPy scan is used instead
+    njit = None
+
+# Mean Earth radius used for haversine distances
+EARTH_RADIUS_KM = 6371.0
+# Query x port pair count from which the brute-force scan uses the Numba kernel; below it
+# the NumPy scan takes milliseconds and is cheaper than the kernel's first-use compile
+NUMBA_MIN_PAIRS = 50_000_000
+# Query count from which BallTree lookups are split across threads
+PARALLEL_MIN_QUERIES = 20_000
+# Upper bound on query x port elements held by one block of the NumPy similarity matrix
+DISTANCE_MATRIX_MAX_ELEMENTS = 4_000_000
+# Bound on the float32 rounding error between two unit-vector dot products. Ports ranked
+# within it of the best float32 match (a few km apart near a port) are re-ranked in float64
+FLOAT32_SIMILARITY_TOLERANCE = 1e-6
+
+def to_unit_vectors(lat_rad, lon_rad):
+    # (N, 3) Cartesian unit vectors for points given in radians
+    cos_lat = np.cos(lat_rad)
+    return np.column_stack([cos_lat * np.cos(lon_rad), cos_lat * np.sin(lon_rad), np.sin(lat_rad)])
+
+# Compiled brute-force scan over port unit vectors: nearest port index and distance (km)
+# for each query, with no (Q, P) temporary and no trig per pair. This module is imported
+# once per process and survives Streamlit reruns, so the kernel is compiled on first use
+@functools.lru_cache(maxsize=None)
+def load_nearest_ports_kernel():
+    if njit is None:
+        return None
+
+    @njit(parallel=True, fastmath=True)
+    def nearest_ports_kernel(q_xyz, p_xyz):
+        n_queries = q_xyz.shape[0]
+        indices = np.empty(n_queries, dtype=np.int64)
+        distances = np.empty(n_queries, dtype=np.float64)
+        for i in prange(n_queries):
+            qx, qy, qz = q_xyz[i, 0], q_xyz[i, 1], q_xyz[i, 2]
+            # Unit-vector dot products are >= -1. fastmath assumes no infinities,
+            # so the running maximum starts below that bound instead of at -inf
+            best_dot = -2.0
+            best_j = 0
+            for j in range(p_xyz.shape[0]):
+                dot = qx * p_xyz[j, 0] + qy * p_xyz[j, 1] + qz * p_xyz[j, 2]
+                if dot > best_dot:
+                    best_dot = dot
+                    best_j = j
+            px, py, pz = p_xyz[best_j, 0], p_xyz[best_j, 1], p_xyz[best_j, 2]
+            cx = qy * pz - qz * py
+            cy = qz * px - qx * pz
+            cz = qx * py - qy * px
+            indices[i] = best_j
+            distances[i] = EARTH_RADIUS_KM * np.arctan2(np.sqrt(cx * cx + cy * cy + cz * cz), best_dot)
+        return indices, distances
+
+    return nearest_ports_kernel
+
+# Nearest port index and distance (km) for each (lat, lon) row in radians
+def find_nearest_ports(coords, ports_xyz, ports_xyz32, ports_tree):
+    if ports_tree is not None:
+        if len(coords) < PARALLEL_MIN_QUERIES:
+            distances, indices = ports_tree.query(coords, k=1)
+        else:
+            # BallTree.query releases the GIL, so threads over query chunks use every core
+            # without copying the tree into worker processes
+            chunks = np.array_split(coords, effective_n_jobs(-1))
+            results = Parallel(n_jobs=-1, prefer='threads')(
+                delayed(ports_tree.query)(chunk, k=1) for chunk in chunks
+            )
+            distances = np.vstack([chunk_distances for chunk_distances, _ in results])
+            indices = np.vstack([chunk_indices for _, chunk_indices in results])
+        return indices[:, 0], distances[:, 0] * EARTH_RADIUS_KM
+    q_xyz = to_unit_vectors(coords[:, 0], coords[:, 1])
+    if len(coords) * len(ports_xyz) >= NUMBA_MIN_PAIRS:
+        nearest_ports_kernel = load_nearest_ports_kernel()
+        if nearest_ports_kernel is not None:
+            return nearest_ports_kernel(q_xyz, ports_xyz)
+    # Great-circle similarity as a BLAS matrix product of unit vectors, built
+    # in row blocks so the (Q, P) product stays bounded for large uploads.
+    # The largest dot product is the nearest port. Ranking runs in float32
+    # (SGEMM, half the memory traffic); the reported distance stays float64.
+    q_xyz32 = q_xyz.astype(np.float32)
+    indices = np.empty(len(coords), dtype=np.intp)
+    block_size = max(1, DISTANCE_MATRIX_MAX_ELEMENTS // len(ports_xyz))
+    for start in range(0, len(coords), block_size):
+        block = slice(start, start + block_size)
+        similarity = q_xyz32[block] @ ports_xyz32.T
+        block_indices = similarity.argmax(axis=1)
+        # float32 cannot order ports whose similarities differ by less than its rounding
+        # error, so rows with a runner-up that close are ranked again in float64
+        best = similarity[np.arange(len(block_indices)), block_indices]
+        n_close = np.count_nonzero(similarity >= (best - FLOAT32_SIMILARITY_TOLERANCE)[:, None], axis=1)
+        ambiguous = np.flatnonzero(n_close > 1)
+        if len(ambiguous):
+            block_indices[ambiguous] = (q_xyz[start + ambiguous] @ ports_xyz.T).argmax(axis=1)
+        indices[block] = block_indices
+    # Vincenty form, arctan2(|a x b|, a . b), stays accurate for tiny and antipodal distances
+    nearest_xyz = ports_xyz[indices]
+    dot = np.einsum('ij,ij->i', q_xyz, nearest_xyz)
+    cross = np.linalg.norm(np.cross(q_xyz, nearest_xyz), axis=1)
+    return indices, EARTH_RADIUS_KM * np.arctan2(cross, dot)
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from sklearn.neighbors import BallTree
+
+import nearest_ports
+from nearest_ports import EARTH_RADIUS_KM, find_nearest_ports, to_unit_vectors
+
+
+def clustered_catalog(rng):
+    # 100 clusters of four ports about 2 km apart, with queries scattered around each;
+    # float32 dot products cannot order ports this close on their own
+    centres = np.column_stack([rng.uniform(-60, 60, 100), rng.uniform(-180, 180, 100)])
+    ports = np.repeat(centres, 4, axis=0) + rng.normal(0, 2 / 111, (400, 2))
+    queries = np.repeat(centres, 200, axis=0) + rng.normal(0, 3 / 111, (20_000, 2))
+    return ports, queries
+
+
+def spread_catalog(rng):
+    # Ports tens of km or more apart, like the bundled ports.csv
+    ports = np.column_stack([rng.uniform(-60, 60, 138), rng.uniform(-180, 180, 138)])
+    queries = np.column_stack([rng.uniform(-80, 80, 20_000), rng.uniform(-180, 180, 20_000)])
+    return ports, queries
+
+
+def float64_reference(q_xyz, ports_xyz):
+    indices = (q_xyz @ ports_xyz.T).argmax(axis=1)
+    nearest_xyz = ports_xyz[indices]
+    dot = np.einsum('ij,ij->i', q_xyz, nearest_xyz)
+    cross = np.linalg.norm(np.cross(q_xyz, nearest_xyz), axis=1)
+    return indices, EARTH_RADIUS_KM * np.arctan2(cross, dot)
+
+
+@pytest.fixture(params=[clustered_catalog, spread_catalog], ids=['clustered', 'spread'])
+def catalog(request):
+    ports, queries = request.param(np.random.default_rng(0))
+    ports_rad = np.radians(ports)
+    coords = np.radians(queries)
+    ports_xyz = to_unit_vectors(ports_rad[:, 0], ports_rad[:, 1])
+    expected = float64_reference(to_unit_vectors(coords[:, 0], coords[:, 1]), ports_xyz)
+    return coords, ports_rad, ports_xyz, expected
+
+
+def assert_matches_reference(result, expected):
+    indices, distances = result
+    np.testing.assert_array_equal(indices, expected[0])
+    np.testing.assert_allclose(distances, expected[1], rtol=0, atol=1e-6)
+
+
+def test_float32_scan_matches_float64(catalog):
+    coords, _, ports_xyz, expected = catalog
+    result = find_nearest_ports(coords, ports_xyz, ports_xyz.astype(np.float32), None)
+    assert_matches_reference(result, expected)
+
+
+def test_float32_scan_matches_float64_across_blocks(catalog, monkeypatch):
+    coords, _, ports_xyz, expected = catalog
+    monkeypatch.setattr(nearest_ports, 'DISTANCE_MATRIX_MAX_ELEMENTS', 7 * len(ports_xyz))
+    result = find_nearest_ports(coords, ports_xyz, ports_xyz.astype(np.float32), None)
+    assert_matches_reference(result, expected)
+
+
+def test_numba_kernel_matches_float64(catalog, monkeypatch):
+    pytest.importorskip('numba')
+    coords, _, ports_xyz, expected = catalog
+    monkeypatch.setattr(nearest_ports, 'NUMBA_MIN_PAIRS', 0)
+    result = find_nearest_ports(coords, ports_xyz, ports_xyz.astype(np.float32), None)
+    assert_matches_reference(result, expected)
+
+
+@pytest.mark.parametrize('parallel_min_queries', [nearest_ports.PARALLEL_MIN_QUERIES, 0],
+                         ids=['serial', 'threaded'])
+def test_balltree_matches_float64(catalog, monkeypatch, parallel_min_queries):
+    coords, ports_rad, ports_xyz, expected = catalog
+    monkeypatch.setattr(nearest_ports, 'PARALLEL_MIN_QUERIES', parallel_min_queries)
+    tree = BallTree(ports_rad, metric='haversine')
+    result = find_nearest_ports(coords, ports_xyz, ports_xyz.astype(np.float32), tree)
+    assert_matches_reference(result, expected)